@@ -0,0 +1,140 @@
+"""
+Helpers for reading contact data from async code without decoding and
+normalising values on the event loop.
+
+Queries are run in a dedicated thread, and the stored JSON is normalised in
+batches on an executor. Pass a ProcessPoolExecutor to spread large batches
+across cores.
+
+Model fields are normalised by the field itself, which Django pickles as a
+reference to the model and field name. Other fields (e.g. form fields) are
+normalised by a plain BaseContactField with the same schema, so any
+customised normalisation of their class is not applied.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.db import connections
+from django.db.models import TextField
+from django.db.models.functions import Cast
+
+from .fields import BaseContactField
+from .utils import AccessDict
+
+RAW_ANNOTATION = "_contactfield_raw"
+
+
+@lru_cache(maxsize=32)
+def _schema_field(schema):
+    valid_groups, valid_labels, concise = schema
+    return BaseContactField(
+        valid_groups=valid_groups, valid_labels=valid_labels, concise=concise
+    )
+
+
+def _normaliser(field):
+    if getattr(field, "model", None) is not None:
+        return field
+    return field.schema_key()
+
+
+def normalize_many(normaliser, values):
+    """
+    Normalise a batch of stored values for a model field, or a field schema
+    (see `BaseContactField.schema_key`). This is run on the executor, so only
+    takes arguments that can be pickled.
+    """
+    if isinstance(normaliser, tuple):
+        field = _schema_field(normaliser)
+    else:
+        field = normaliser
+    return [AccessDict.prepare(field.as_dict(value)) for value in values]
+
+
+def _batches(values, batch_size):
+    for i in range(0, len(values), batch_size):
+        yield values[i : i + batch_size]
+
+
+async def anormalize_many(field, values, executor=None, batch_size=500):
+    """
+    Normalise a list of stored or decoded values for a contact field, with each
+    batch normalised on the executor (the event loop's default executor if
+    not given)
+    """
+    values = list(values)
+    if not values:
+        return []
+    loop = asyncio.get_running_loop()
+    normaliser = _normaliser(field)
+    results = await asyncio.gather(
+        *[
+            loop.run_in_executor(executor, normalize_many, normaliser, batch)
+            for batch in _batches(values, batch_size)
+        ]
+    )
+    return [value for batch in results for value in batch]
+
+
+def _fetch_chunk(queryset, last_pk, chunk_size):
+    if last_pk is not None:
+        queryset = queryset.filter(pk__gt=last_pk)
+    return list(queryset[:chunk_size])
+
+
+def _close_connections():
+    for connection in connections.all():
+        connection.close()
+
+
+async def aiter_contacts(
+    queryset, field_name, chunk_size=2000, executor=None, batch_size=500
+):
+    """
+    Asynchronously iterate over (pk, value) for a contact field in a queryset,
+    in primary key order. The next chunk is fetched while the current one is
+    normalised.
+    """
+    field = queryset.model._meta.get_field(field_name)
+    queryset = (
+        queryset.annotate(
+            **{RAW_ANNOTATION: Cast(field_name, output_field=TextField())}
+        )
+        .order_by("pk")
+        .values_list("pk", RAW_ANNOTATION)
+    )
+    loop = asyncio.get_running_loop()
+    # Database connections belong to a thread, so keep all queries on one
+    db_executor = ThreadPoolExecutor(max_workers=1)
+    pending = None
+    try:
+        pending = loop.run_in_executor(
+            db_executor, _fetch_chunk, queryset, None, chunk_size
+        )
+        while True:
+            rows = await pending
+            if not rows:
+                break
+            if len(rows) == chunk_size:
+                pending = loop.run_in_executor(
+                    db_executor, _fetch_chunk, queryset, rows[-1][0], chunk_size
+                )
+            else:
+                pending = None
+            values = await anormalize_many(
+                field,
+                [raw for pk, raw in rows],
+                executor=executor,
+                batch_size=batch_size,
+            )
+            for (pk, raw), value in zip(rows, values):
+                yield pk, value
+            if pending is None:
+                break
+    finally:
+        if pending is not None:
+            await asyncio.wait([pending])
+        await loop.run_in_executor(db_executor, _close_connections)
+        db_executor.shutdown(wait=False)
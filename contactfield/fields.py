@@ -1,12 +1,27 @@
 import json
 
-from django.utils.translation import pgettext_lazy as _p, gettext_lazy as _
-from jsonfield.fields import JSONFormField, JSONField
-
-
-from .utils import AccessDict, CastOnAssign
+from django.db import models
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.utils.translation import gettext_lazy as _
+from django.utils.translation import pgettext_lazy as _p
+
+from jsonfield.fields import JSONField
+from jsonfield.fields import JSONFormField
+
+from .search import index_on_save
+from .search import remove_on_delete
+from .utils import AccessDict
+from .utils import CastOnAssign
+from .utils import FrozenAccessDict
+from .utils import LRUCache
+from .utils import contact_fingerprint
+from .utils import copy_contact_dict
 from .widgets import NullWidget
 
+# Frozen default and initial values, shared between fields with the same schema
+_shared_values = LRUCache(maxsize=128)
+
 
 class BaseContactField(object):
     """
@@ -26,6 +41,10 @@ class BaseContactField(object):
 
     where group and label are part of the field's valid groups and labels,
     and value is a basic type (integer, string, boolean or null)
+
+    Passing cache_size will memoise the results of `as_dict` for empty and
+    string values in a bounded LRU cache, so that repeated raw payloads are
+    only parsed once.
     """
 
     valid_groups = (
@@ -149,6 +168,7 @@ class BaseContactField(object):
         update_group_display_names=None,
         update_label_display_names=None,
         concise=False,
+        cache_size=None,
         *args,
         **kwargs
     ):
@@ -198,12 +218,20 @@ class BaseContactField(object):
 
         self._concise = concise
 
+        # Normalisation cache
+
+        self._cache_size = cache_size
+        if cache_size:
+            self._as_dict_cache = LRUCache(maxsize=cache_size)
+        else:
+            self._as_dict_cache = None
+
         # Initial values
 
         if "default" in kwargs:
-            kwargs["default"] = self.as_dict(kwargs["default"])
+            kwargs["default"] = self.frozen_dict(kwargs["default"])
         if "initial" in kwargs:
-            kwargs["initial"] = self.as_dict(kwargs["initial"])
+            kwargs["initial"] = self.frozen_dict(kwargs["initial"])
 
         super().__init__(*args, **kwargs)
 
@@ -243,6 +271,51 @@ class BaseContactField(object):
         formatting issues are encountered with the value, then a blank initial
         dictionary will be returned.
         """
+        if self._as_dict_cache is None:
+            return self._as_dict(value)
+
+        if not value:
+            raw = None
+        elif isinstance(value, str):
+            raw = value
+        else:
+            # Dictionaries are unhashable, so can't be used as a cache key
+            return self._as_dict(value)
+
+        key = (self.schema_key(), raw)
+        cached = self._as_dict_cache.get(key)
+        if cached is None:
+            cached = self._as_dict(raw)
+            self._as_dict_cache.set(key, cached)
+        # Callers are free to modify the result, so never hand out the cached
+        # dictionary (or any mutable values within it)
+        return copy_contact_dict(cached)
+
+    def frozen_dict(self, value):
+        """
+        Return the contact field as an immutable dictionary of groups and
+        labels. The same object is returned for equal values on fields with
+        the same schema and normalisation methods, so it can be shared freely.
+        """
+        try:
+            raw = value if isinstance(value, str) else json.dumps(value, sort_keys=True)
+        except (TypeError, ValueError):
+            return FrozenAccessDict.prepare(self.as_dict(value))
+
+        # Subclasses may normalise values differently, but model and form
+        # fields that share the same methods can share the same values
+        cls = type(self)
+        schema = (cls.as_dict, cls._as_dict, cls._initial_dict, self.schema_key())
+        frozen = _shared_values.get((schema, raw))
+        if frozen is None:
+            frozen = FrozenAccessDict.prepare(self.as_dict(value))
+            _shared_values.set((schema, raw), frozen)
+            # Normalising is idempotent, so the result can be reused when it is
+            # passed back in (e.g. as the initial value of a form field)
+            _shared_values.set((schema, json.dumps(frozen, sort_keys=True)), frozen)
+        return frozen
+
+    def _as_dict(self, value):
         if value and isinstance(value, str):
             try:
                 value = json.loads(value)
@@ -263,6 +336,30 @@ class BaseContactField(object):
     def concise_mode(self):
         return self._concise
 
+    def schema_key(self):
+        """
+        A hashable representation of everything that affects the output of
+        `as_dict`
+        """
+        return (
+            tuple(self.get_valid_groups()),
+            tuple(self.get_valid_labels()),
+            bool(self.concise_mode()),
+        )
+
+    def cache_info(self):
+        """
+        Return the hits, misses and size of the `as_dict` cache, or None if
+        caching is disabled
+        """
+        if self._as_dict_cache is None:
+            return None
+        return self._as_dict_cache.info()
+
+    def cache_clear(self):
+        if self._as_dict_cache is not None:
+            self._as_dict_cache.clear()
+
 
 class ContactFormField(BaseContactField, JSONFormField):
 
@@ -283,10 +380,35 @@ class ContactFormField(BaseContactField, JSONFormField):
 
 
 class ContactField(BaseContactField, JSONField):
+    """
+    Model field for storing contact data.
+
+    To find contacts sharing the same details without loading every row, pass
+    a dictionary of fingerprints, each with optional groups and labels (all
+    valid groups or labels are used if these are left out):
+
+    fingerprints = {
+        'billing_address': {
+            'groups': ['billing'],
+            'labels': ['address_1', 'postal_code'],
+        },
+        'email': {'labels': ['email']},
+    }
+
+    An indexed ContactFingerprintField named <field>_<fingerprint>_fingerprint
+    is added to the model for each one, holding a hash of the case and
+    whitespace folded values.
+
+    Pass search_index=True to add the field's values to the contact search
+    index (see contactfield.search) whenever the model is saved.
+    """
 
     def __init__(self, *args, **kwargs):
         if not "default" in kwargs:
             kwargs["default"] = {}
+        self._fingerprints = kwargs.pop("fingerprints", None) or {}
+        self.search_index = kwargs.pop("search_index", False)
+        self._prep_default = None
         super(ContactField, self).__init__(*args, **kwargs)
 
     def contribute_to_class(self, cls, name):
@@ -297,12 +419,77 @@ class ContactField(BaseContactField, JSONField):
         super(ContactField, self).contribute_to_class(cls, name)
         setattr(cls, name, CastOnAssign(self))
 
+        # Abstract models pass a copy of this field on to their children, which
+        # will add the fingerprint fields themselves
+        if cls._meta.abstract:
+            return
+        for fingerprint, options in self._fingerprints.items():
+            cls.add_to_class(
+                self.fingerprint_field_name(fingerprint),
+                ContactFingerprintField(
+                    source=name,
+                    groups=options.get("groups"),
+                    labels=options.get("labels"),
+                ),
+            )
+        if self._fingerprints:
+            post_save.connect(
+                save_fingerprints,
+                sender=cls,
+                dispatch_uid="contactfield_fingerprints_save",
+            )
+
+        if self.search_index:
+            post_save.connect(
+                index_on_save,
+                sender=cls,
+                dispatch_uid="contactfield_search_save",
+            )
+            post_delete.connect(
+                remove_on_delete,
+                sender=cls,
+                dispatch_uid="contactfield_search_delete",
+            )
+
+    def fingerprint_field_name(self, fingerprint):
+        return "{}_{}_fingerprint".format(self.name, fingerprint)
+
+    def get_fingerprint_fields(self):
+        """
+        Return the fingerprint fields that are calculated from this field
+        """
+        return [
+            field
+            for field in self.model._meta.concrete_fields
+            if isinstance(field, ContactFingerprintField) and field.source == self.name
+        ]
+
     def get_default(self):
+        # The frozen default is shared by every new instance, and is only
+        # copied once the instance's value is accessed (see CastOnAssign)
+        if isinstance(self.default, FrozenAccessDict):
+            return self.default
         default = super(ContactField, self).get_default()
         if isinstance(default, dict):
             return AccessDict.prepare(default)
         return default
 
+    def value_from_object(self, obj):
+        # Read the stored value directly so that a shared default isn't copied
+        if self.attname in obj.__dict__:
+            return obj.__dict__[self.attname]
+        return super(ContactField, self).value_from_object(obj)
+
+    def pre_save(self, model_instance, add):
+        return self.value_from_object(model_instance)
+
+    def get_prep_value(self, value):
+        if value is self.default and value is not None:
+            if self._prep_default is None:
+                self._prep_default = super(ContactField, self).get_prep_value(value)
+            return self._prep_default
+        return super(ContactField, self).get_prep_value(value)
+
     def from_db_value(self, value, expression, connection, *args, **kwargs):
         value = super(ContactField, self).from_db_value(
             value, expression, connection, *args, **kwargs
@@ -312,7 +499,14 @@ class ContactField(BaseContactField, JSONField):
         return value
 
     def to_python(self, value):
+        if isinstance(value, FrozenAccessDict):
+            return value
         value = super(ContactField, self).to_python(value)
+        if value and isinstance(value, str):
+            try:
+                value = json.loads(value, **self.decoder_kwargs)
+            except ValueError:
+                return value
         if isinstance(value, dict):
             return AccessDict.prepare(value)
         return value
@@ -327,6 +521,89 @@ class ContactField(BaseContactField, JSONField):
             "update_group_display_names": self.group_display_names,
             "update_label_display_names": self.label_display_names,
             "concise": self._concise,
+            "cache_size": self._cache_size,
         }
         defaults.update(kwargs)
         return super(ContactField, self).formfield(**defaults)
+
+
+class ContactFingerprintField(models.CharField):
+    """
+    Stores a hash of selected values from a contact field, so that contacts
+    sharing the same details can be found with an indexed lookup. The value
+    is recalculated whenever the model is saved or bulk created.
+    """
+
+    def __init__(self, source=None, groups=None, labels=None, *args, **kwargs):
+        self.source = source
+        self.groups = list(groups) if groups is not None else None
+        self.labels = list(labels) if labels is not None else None
+        kwargs["max_length"] = 40
+        kwargs.setdefault("null", True)
+        kwargs.setdefault("blank", True)
+        kwargs.setdefault("editable", False)
+        kwargs.setdefault("db_index", True)
+        super(ContactFingerprintField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(ContactFingerprintField, self).deconstruct()
+        del kwargs["max_length"]
+        # Each of these defaults is the opposite of the standard field default
+        for key, default in (
+            ("null", True),
+            ("blank", True),
+            ("editable", False),
+            ("db_index", True),
+        ):
+            if key in kwargs:
+                del kwargs[key]
+            else:
+                kwargs[key] = not default
+        kwargs["source"] = self.source
+        if self.groups is not None:
+            kwargs["groups"] = self.groups
+        if self.labels is not None:
+            kwargs["labels"] = self.labels
+        return name, path, args, kwargs
+
+    def calculate(self, model_instance):
+        source_field = model_instance._meta.get_field(self.source)
+        return contact_fingerprint(
+            source_field.value_from_object(model_instance),
+            (
+                self.groups
+                if self.groups is not None
+                else source_field.get_valid_groups()
+            ),
+            (
+                self.labels
+                if self.labels is not None
+                else source_field.get_valid_labels()
+            ),
+        )
+
+    def pre_save(self, model_instance, add):
+        value = self.calculate(model_instance)
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+def save_fingerprints(
+    sender, instance, raw=False, using=None, update_fields=None, **kwargs
+):
+    """
+    Fingerprints are only saved with their contact field when also named in
+    update_fields, so save any that were left out
+    """
+    if raw or update_fields is None:
+        return
+    values = {}
+    for field in sender._meta.concrete_fields:
+        if (
+            isinstance(field, ContactFingerprintField)
+            and field.source in update_fields
+            and field.name not in update_fields
+        ):
+            values[field.attname] = field.pre_save(instance, False)
+    if values:
+        sender._base_manager.using(using).filter(pk=instance.pk).update(**values)
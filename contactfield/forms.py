@@ -56,6 +56,10 @@ class ContactFieldFormMixin(object):
             contact_field_kwargs = self.contact_field_kwargs
 
         self._contact_pseudo_fields = {}
+        # Map each pseudo field name to the group and label it updates, so
+        # that submitted data can be merged without parsing field names
+        self._contact_pseudo_field_routes = {}
+        self._contact_initial_values = {}
         pseudo_fields = {}
         for field_name, field in filter(
             lambda pair: isinstance(pair[1], ContactFormField), self.fields.items()
@@ -73,7 +77,14 @@ class ContactFieldFormMixin(object):
                 if valid_labels_for_field is None or label in valid_labels_for_field
             ]
 
+            if self[field_name].value() is not None:
+                initial_value = field.as_dict(self[field_name].value())
+            else:
+                initial_value = None
+            self._contact_initial_values[field_name] = initial_value
+
             self._contact_pseudo_fields[field_name] = {}
+            self._contact_pseudo_field_routes[field_name] = {}
             for valid_group in valid_groups:
                 for valid_label in valid_labels:
                     pseudo_field_name = f"{field_name}__{valid_group}__{valid_label}"
@@ -82,13 +93,8 @@ class ContactFieldFormMixin(object):
                     FieldClass = field_kwargs.pop("field", forms.CharField)
                     if not "required" in field_kwargs:
                         field_kwargs["required"] = False
-                    if self[field_name].value() is not None:
-                        initial = (
-                            self.fields[field_name]
-                            .as_dict(self[field_name].value())
-                            .get(valid_group, {})
-                            .get(valid_label)
-                        )
+                    if initial_value is not None:
+                        initial = initial_value.get(valid_group, {}).get(valid_label)
                     else:
                         initial = None
 
@@ -114,6 +120,10 @@ class ContactFieldFormMixin(object):
                     self._contact_pseudo_fields[field_name][
                         pseudo_field_name
                     ] = pseudo_field
+                    self._contact_pseudo_field_routes[field_name][pseudo_field_name] = (
+                        valid_group,
+                        valid_label,
+                    )
         self.fields.update(pseudo_fields)
 
     def __getattribute__(self, name, *args, **kwargs):
@@ -126,18 +136,27 @@ class ContactFieldFormMixin(object):
         Find all the psueduo fields for a contact field in form data, and use
         them to update the main field.
         """
-        cleaned_data = self.fields[contact_field_name].as_dict(
-            self[contact_field_name].value()
-        )
-        for pseudo_field_name, field in self._contact_pseudo_fields[
-            contact_field_name
-        ].items():
+        contact_field = self.fields[contact_field_name]
+        initial_value = self._contact_initial_values[contact_field_name]
+        if initial_value is not None:
+            cleaned_data = {
+                group: dict(labels) for group, labels in initial_value.items()
+            }
+        else:
+            cleaned_data = contact_field.as_dict(None)
+        concise = contact_field.concise_mode()
+        routes = self._contact_pseudo_field_routes[contact_field_name]
+
+        # Only look at whichever of the submitted data or the pseudo fields is
+        # smaller
+        if len(self.data) < len(routes):
+            names = (name for name in self.data if name in routes)
+        else:
+            names = routes
+        for pseudo_field_name in names:
             pseudo_field_value = self.data.get(pseudo_field_name, None)
             if pseudo_field_value is not None:
-                if (
-                    pseudo_field_value
-                    or not self.fields[contact_field_name].concise_mode()
-                ):
-                    field_name, group, label = pseudo_field_name.split("__")
+                if pseudo_field_value or not concise:
+                    group, label = routes[pseudo_field_name]
                     cleaned_data.setdefault(group, {})[label] = pseudo_field_value
         return cleaned_data
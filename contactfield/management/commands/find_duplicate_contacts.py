@@ -0,0 +1,77 @@
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from contactfield.fields import ContactFingerprintField
+from contactfield.querysets import ContactQuerySet
+
+
+class Command(BaseCommand):
+    help = (
+        "Report groups of rows that share the same contact fingerprint, e.g. "
+        "customers with the same billing address or email"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", help="Model in the form app_label.ModelName")
+        parser.add_argument("fingerprint", help="Name of the fingerprint field")
+        parser.add_argument(
+            "--min-count",
+            type=int,
+            default=2,
+            help="Only report fingerprints shared by at least this many rows",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=100,
+            help="Maximum number of duplicate groups to report",
+        )
+        parser.add_argument(
+            "--refresh",
+            action="store_true",
+            help="Recalculate all fingerprints before searching",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options["model"])
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+
+        fingerprint_field_name = options["fingerprint"]
+        try:
+            fingerprint_field = model._meta.get_field(fingerprint_field_name)
+        except FieldDoesNotExist:
+            fingerprint_field = None
+        if not isinstance(fingerprint_field, ContactFingerprintField):
+            raise CommandError(
+                "{} has no contact fingerprint field called {}".format(
+                    options["model"], fingerprint_field_name
+                )
+            )
+
+        queryset = ContactQuerySet(model=model)
+        if options["refresh"]:
+            count = queryset.refresh_fingerprints()
+            self.stdout.write("Refreshed fingerprints for {} rows".format(count))
+
+        duplicates = queryset.duplicate_contacts(
+            fingerprint_field_name, min_count=options["min_count"]
+        )[: options["limit"]]
+        found = 0
+        for duplicate in duplicates:
+            fingerprint = duplicate[fingerprint_field_name]
+            pks = queryset.filter(**{fingerprint_field_name: fingerprint}).values_list(
+                "pk", flat=True
+            )
+            self.stdout.write(
+                "{} ({} rows): {}".format(
+                    fingerprint,
+                    duplicate["count"],
+                    ", ".join(str(pk) for pk in pks),
+                )
+            )
+            found += 1
+        self.stdout.write("Found {} duplicate groups".format(found))
@@ -0,0 +1,27 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db import migrations
+
+from contactfield.search import get_backend
+
+
+def create_search_index(apps, schema_editor):
+    try:
+        backend = get_backend(schema_editor.connection)
+    except ImproperlyConfigured:
+        return
+    backend.create_table(schema_editor)
+
+
+def drop_search_index(apps, schema_editor):
+    try:
+        backend = get_backend(schema_editor.connection)
+    except ImproperlyConfigured:
+        return
+    backend.drop_table(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = []
+
+    operations = [migrations.RunPython(create_search_index, drop_search_index)]
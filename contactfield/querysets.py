@@ -0,0 +1,223 @@
+import warnings
+
+from django.db import models
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import TextField
+from django.db.models.functions import Cast
+
+from . import search
+from .fields import ContactField
+from .serializers import RAW_SUFFIX
+
+
+class ContactQuerySet(models.QuerySet):
+    """
+    A queryset for models with contact fields, which keeps any contact
+    fingerprints and search entries up to date on bulk operations, and can
+    report duplicates and search contacts.
+
+    class ContactModel(models.Model):
+        ...
+        objects = ContactQuerySet.as_manager()
+    """
+
+    def _contact_fields(self):
+        return [
+            field
+            for field in self.model._meta.concrete_fields
+            if isinstance(field, ContactField)
+        ]
+
+    def _search_field_names(self):
+        return [field.name for field in search.get_search_fields(self.model)]
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super(ContactQuerySet, self).bulk_create(objs, *args, **kwargs)
+        if self._search_field_names():
+            # Only backends that return primary keys from bulk inserts can
+            # index the new rows here
+            if any(obj.pk is None for obj in objs):
+                warnings.warn(
+                    "{} rows created by bulk_create() were not added to the "
+                    "contact search index, as the database didn't return their "
+                    "primary keys. Call reindex_contacts() on a queryset of the "
+                    "new rows.".format(self.model._meta.label),
+                    RuntimeWarning,
+                    stacklevel=2,
+                )
+            search.index_contacts(self.model, objs, using=self.db)
+        return objs
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        objs = list(objs)
+        fields = list(fields)
+        for contact_field in self._contact_fields():
+            if contact_field.name not in fields:
+                continue
+            for fingerprint_field in contact_field.get_fingerprint_fields():
+                for obj in objs:
+                    fingerprint_field.pre_save(obj, False)
+                if fingerprint_field.name not in fields:
+                    fields.append(fingerprint_field.name)
+        result = super(ContactQuerySet, self).bulk_update(
+            objs, fields, batch_size=batch_size
+        )
+        if set(fields) & set(self._search_field_names()):
+            search.index_contacts(self.model, objs, using=self.db)
+        return result
+
+    def update(self, **kwargs):
+        # Expressions are only evaluated by the database, so their fingerprints
+        # and search entries can only be calculated after the update
+        in_batches = False
+        for contact_field in self._contact_fields():
+            if contact_field.name not in kwargs:
+                continue
+            value = kwargs[contact_field.name]
+            fingerprint_fields = contact_field.get_fingerprint_fields()
+            if hasattr(value, "resolve_expression"):
+                if fingerprint_fields or contact_field.search_index:
+                    in_batches = True
+                continue
+            value = kwargs[contact_field.name] = contact_field.to_python(value)
+            # Calculate fingerprints against an unsaved instance holding the
+            # new value
+            instance = self.model(**{contact_field.attname: value})
+            for fingerprint_field in fingerprint_fields:
+                kwargs[fingerprint_field.name] = fingerprint_field.calculate(instance)
+
+        if in_batches:
+            return self._update_in_batches(kwargs)
+
+        search_values = {
+            name: kwargs[name] for name in self._search_field_names() if name in kwargs
+        }
+        if not search_values:
+            return super(ContactQuerySet, self).update(**kwargs)
+
+        # Every row gets the same entries, so they can be copied for the rows
+        # selected by a subquery. The filter may no longer match after the
+        # update, so this is done first.
+        with transaction.atomic(using=self.db, savepoint=False):
+            search.index_contacts_for_update(self, search_values)
+            return super(ContactQuerySet, self).update(**kwargs)
+
+    update.alters_data = True
+
+    def _update_in_batches(self, kwargs, batch_size=1000):
+        rows = 0
+        base = ContactQuerySet(self.model, using=self.db)
+        pks = self.order_by("pk").values_list("pk", flat=True)
+        with transaction.atomic(using=self.db, savepoint=False):
+            last_pk = None
+            while True:
+                batch = pks if last_pk is None else pks.filter(pk__gt=last_pk)
+                batch = list(batch[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1]
+                batch_qs = base.filter(pk__in=batch)
+                rows += models.QuerySet.update(batch_qs, **kwargs)
+                batch_qs.refresh_fingerprints(batch_size=batch_size)
+                batch_qs.reindex_contacts(batch_size=batch_size)
+        return rows
+
+    _update_in_batches.alters_data = True
+
+    def duplicate_contacts(self, fingerprint_field_name, min_count=2):
+        """
+        Return the fingerprints shared by at least min_count rows, with the
+        number of rows for each, most duplicated first
+        """
+        return (
+            self.filter(**{fingerprint_field_name + "__isnull": False})
+            .order_by()
+            .values(fingerprint_field_name)
+            .annotate(count=Count("pk"))
+            .filter(count__gte=min_count)
+            .order_by("-count", fingerprint_field_name)
+        )
+
+    def with_raw_contacts(self, *fields):
+        """
+        Fetch the stored JSON of the given contact fields (or all of them) as
+        <field>_json strings, instead of decoding them. Use with
+        `contactfield.serializers.raw_contact()`.
+        """
+        if not fields:
+            fields = [field.name for field in self._contact_fields()]
+        return self.defer(*fields).annotate(
+            **{
+                field_name + RAW_SUFFIX: Cast(field_name, output_field=TextField())
+                for field_name in fields
+            }
+        )
+
+    def search_contacts(self, query, fields=None):
+        """
+        Filter to rows with a contact value matching the start of every word
+        in the query, annotated with a search_rank and best matches first. The
+        matching and ranking are done by the database.
+        """
+        sql = search.search_sql(self.model, query, field_names=fields, using=self.db)
+        if sql is None:
+            return self.none()
+        where, rank, params = sql
+        # The rank is an extra select rather than an annotation, so that it
+        # isn't calculated for count() and exists()
+        return self.extra(
+            select={"search_rank": rank},
+            select_params=params,
+            where=[where],
+            params=params,
+        ).order_by("-search_rank", "pk")
+
+    def reindex_contacts(self, batch_size=1000):
+        """
+        Rebuild the search entries for every row, e.g. after a bulk create on a
+        database that doesn't return primary keys
+        """
+        if not self._search_field_names():
+            return 0
+        count = 0
+        objs = []
+        for obj in self.iterator(chunk_size=batch_size):
+            objs.append(obj)
+            if len(objs) >= batch_size:
+                search.index_contacts(self.model, objs, using=self.db)
+                count += len(objs)
+                objs = []
+        if objs:
+            search.index_contacts(self.model, objs, using=self.db)
+            count += len(objs)
+        return count
+
+    def refresh_fingerprints(self, batch_size=1000):
+        """
+        Recalculate all contact fingerprints, e.g. after adding a fingerprint
+        to an existing field
+        """
+        fingerprint_fields = [
+            fingerprint_field
+            for contact_field in self._contact_fields()
+            for fingerprint_field in contact_field.get_fingerprint_fields()
+        ]
+        if not fingerprint_fields:
+            return 0
+
+        field_names = [field.name for field in fingerprint_fields]
+        count = 0
+        objs = []
+        for obj in self.iterator(chunk_size=batch_size):
+            for fingerprint_field in fingerprint_fields:
+                fingerprint_field.pre_save(obj, False)
+            objs.append(obj)
+            if len(objs) >= batch_size:
+                self.model._base_manager.bulk_update(objs, field_names)
+                count += len(objs)
+                objs = []
+        if objs:
+            self.model._base_manager.bulk_update(objs, field_names)
+            count += len(objs)
+        return count
@@ -0,0 +1,48 @@
+"""
+Django REST Framework support for returning stored contact JSON verbatim.
+
+class CustomerSerializer(serializers.ModelSerializer):
+    contact_info = RawContactSerializerField()
+
+class CustomerViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = Customer.objects.with_raw_contacts()
+    serializer_class = CustomerSerializer
+    renderer_classes = [ContactJSONRenderer]
+
+Other renderers (such as the browsable API) still work, but decode and
+re-encode the values.
+"""
+
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .serializers import RawJSONMixin
+from .serializers import raw_contact
+
+
+class ContactRESTJSONEncoder(RawJSONMixin, JSONEncoder):
+    pass
+
+
+class ContactJSONRenderer(JSONRenderer):
+    """
+    Renders RawJSON values from RawContactSerializerField verbatim
+    """
+
+    encoder_class = ContactRESTJSONEncoder
+
+
+class RawContactSerializerField(serializers.Field):
+    """
+    A read only field which outputs a contact field's stored JSON, only
+    normalising values that don't match the field's current groups and labels
+    """
+
+    def __init__(self, **kwargs):
+        kwargs["read_only"] = True
+        kwargs["source"] = "*"
+        super(RawContactSerializerField, self).__init__(**kwargs)
+
+    def to_representation(self, instance):
+        return raw_contact(instance, self.field_name)
@@ -0,0 +1,367 @@
+"""
+A full text search index over the values of contact fields.
+
+Each populated group and label of an indexed field is stored as a separate
+entry in a side table, which is searched using the database's own full text
+engine (FTS5 for SQLite, tsvector for PostgreSQL). The tables are created by
+the contactfield migrations, so `contactfield` must be in INSTALLED_APPS.
+"""
+
+import re
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.db import router
+from django.db import transaction
+
+TABLE_NAME = "contactfield_search"
+
+
+class SearchBackend(object):
+    """
+    Stores and searches (group, label, value) entries for contact fields.
+    Subclasses provide the database specific SQL.
+    """
+
+    table_name = TABLE_NAME
+    columns = "model, field_name, object_id, grp, label, value"
+    # How the value parameter is written to the value column(s)
+    value_sql = "%s"
+
+    def create_table(self, schema_editor):
+        raise NotImplementedError
+
+    def drop_table(self, schema_editor):
+        raise NotImplementedError
+
+    def insert_sql(self):
+        return "INSERT INTO {} ({}) VALUES (%s, %s, %s, %s, %s, {})".format(
+            self.table_name, self.columns, self.value_sql
+        )
+
+    def entry_params(self, entry):
+        return list(entry)
+
+    def match_sql(self, term_count, field_count):
+        """
+        Return SQL selecting (object_id, score) for each object where every
+        term query matches at least one of its entries (not necessarily the
+        same one), where a higher score is a better match
+        """
+        raise NotImplementedError
+
+    def format_query(self, term):
+        """
+        Return a full text query matching entries with a word starting with
+        the term
+        """
+        raise NotImplementedError
+
+    def delete(self, cursor, model_label, field_name, object_ids):
+        if not object_ids:
+            return
+        cursor.execute(
+            "DELETE FROM {} WHERE model = %s AND field_name = %s "
+            "AND object_id IN ({})".format(
+                self.table_name, ", ".join(["%s"] * len(object_ids))
+            ),
+            [model_label, field_name] + list(object_ids),
+        )
+
+    def insert(self, cursor, entries):
+        if entries:
+            cursor.executemany(
+                self.insert_sql(), [self.entry_params(entry) for entry in entries]
+            )
+
+    def delete_for_query(self, cursor, model_label, field_name, ids_sql, ids_params):
+        """
+        Delete entries for the object ids selected by ids_sql
+        """
+        cursor.execute(
+            "DELETE FROM {} WHERE model = %s AND field_name = %s "
+            "AND object_id IN ({})".format(self.table_name, ids_sql),
+            [model_label, field_name] + list(ids_params),
+        )
+
+    def insert_for_query(self, cursor, entry, ids_sql, ids_params):
+        """
+        Insert a copy of an entry (ignoring its object id) for every object id
+        selected by ids_sql
+        """
+        params = self.entry_params(entry)
+        cursor.execute(
+            "INSERT INTO {} ({}) SELECT %s, %s, ids.object_id, %s, %s, {} "
+            "FROM ({}) ids".format(
+                self.table_name, self.columns, self.value_sql, ids_sql
+            ),
+            params[:2] + params[3:] + list(ids_params),
+        )
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+    Entries are kept in a normal table, with an external content FTS5 table
+    kept in sync by triggers
+    """
+
+    def create_table(self, schema_editor):
+        table = self.table_name
+        for sql in (
+            "CREATE TABLE {table} ("
+            "id INTEGER PRIMARY KEY, model TEXT NOT NULL, "
+            "field_name TEXT NOT NULL, object_id TEXT NOT NULL, "
+            "grp TEXT NOT NULL, label TEXT NOT NULL, value TEXT NOT NULL)",
+            "CREATE INDEX {table}_object ON {table} (model, field_name, object_id)",
+            "CREATE VIRTUAL TABLE {table}_fts USING fts5("
+            "value, content='{table}', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2')",
+            "CREATE TRIGGER {table}_ai AFTER INSERT ON {table} BEGIN "
+            "INSERT INTO {table}_fts (rowid, value) VALUES (new.id, new.value); "
+            "END",
+            "CREATE TRIGGER {table}_ad AFTER DELETE ON {table} BEGIN "
+            "INSERT INTO {table}_fts ({table}_fts, rowid, value) "
+            "VALUES ('delete', old.id, old.value); "
+            "END",
+        ):
+            schema_editor.execute(sql.format(table=table))
+
+    def drop_table(self, schema_editor):
+        table = self.table_name
+        schema_editor.execute("DROP TABLE IF EXISTS {}_fts".format(table))
+        schema_editor.execute("DROP TABLE IF EXISTS {}".format(table))
+
+    def match_sql(self, term_count, field_count):
+        # bm25 returns lower values for better matches. It can only be used in
+        # a plain full text query, so each term is matched in a subquery that
+        # can't be flattened into the join
+        term_sql = (
+            "SELECT * FROM (SELECT rowid AS id, bm25({table}_fts) AS score, "
+            "{term} AS term FROM {table}_fts WHERE {table}_fts MATCH %s LIMIT -1)"
+        )
+        return (
+            "SELECT e.object_id AS object_id, -SUM(m.score) AS score FROM ("
+            "{terms}) m JOIN {table} e ON e.id = m.id "
+            "WHERE e.model = %s AND e.field_name IN ({fields}) "
+            "GROUP BY e.object_id HAVING COUNT(DISTINCT m.term) = {count}".format(
+                terms=" UNION ALL ".join(
+                    term_sql.format(table=self.table_name, term=term)
+                    for term in range(term_count)
+                ),
+                table=self.table_name,
+                fields=", ".join(["%s"] * field_count),
+                count=term_count,
+            )
+        )
+
+    def format_query(self, term):
+        return '"{}"*'.format(term.replace('"', '""'))
+
+
+class PostgreSQLSearchBackend(SearchBackend):
+    """
+    Entries are stored with a precalculated tsvector, using the 'simple'
+    configuration as names and addresses shouldn't be stemmed
+    """
+
+    columns = "model, field_name, object_id, grp, label, value, document"
+    value_sql = "%s, to_tsvector('simple', %s)"
+
+    def create_table(self, schema_editor):
+        table = self.table_name
+        for sql in (
+            "CREATE TABLE {table} ("
+            "id bigserial PRIMARY KEY, model text NOT NULL, "
+            "field_name text NOT NULL, object_id text NOT NULL, "
+            "grp text NOT NULL, label text NOT NULL, value text NOT NULL, "
+            "document tsvector NOT NULL)",
+            "CREATE INDEX {table}_object ON {table} (model, field_name, object_id)",
+            "CREATE INDEX {table}_document ON {table} USING GIN (document)",
+        ):
+            schema_editor.execute(sql.format(table=table))
+
+    def drop_table(self, schema_editor):
+        schema_editor.execute("DROP TABLE IF EXISTS {}".format(self.table_name))
+
+    def entry_params(self, entry):
+        return list(entry) + [entry[-1]]
+
+    def match_sql(self, term_count, field_count):
+        return (
+            "SELECT e.object_id AS object_id, SUM(ts_rank(e.document, q.query)) "
+            "AS score FROM {table} e JOIN (VALUES {terms}) q (term, query) "
+            "ON e.document @@ q.query WHERE e.model = %s "
+            "AND e.field_name IN ({fields}) "
+            "GROUP BY e.object_id HAVING COUNT(DISTINCT q.term) = {count}".format(
+                table=self.table_name,
+                terms=", ".join(
+                    "({}, to_tsquery('simple', %s))".format(term)
+                    for term in range(term_count)
+                ),
+                fields=", ".join(["%s"] * field_count),
+                count=term_count,
+            )
+        )
+
+    def format_query(self, term):
+        return "{}:*".format(term)
+
+
+backends = {
+    "sqlite": SQLiteSearchBackend(),
+    "postgresql": PostgreSQLSearchBackend(),
+}
+
+
+def get_backend(connection):
+    try:
+        return backends[connection.vendor]
+    except KeyError:
+        raise ImproperlyConfigured(
+            "Contact search is not supported for {} databases".format(connection.vendor)
+        )
+
+
+def get_search_fields(model):
+    return [
+        field
+        for field in model._meta.concrete_fields
+        if getattr(field, "search_index", False)
+    ]
+
+
+def search_entries(field, obj, object_id):
+    """
+    Return an index entry for every populated group and label of the field
+    """
+    value = field.value_from_object(obj)
+    if not isinstance(value, dict):
+        return []
+    model_label = obj._meta.label_lower
+    entries = []
+    for group in field.get_valid_groups():
+        group_values = value.get(group)
+        if not isinstance(group_values, dict):
+            continue
+        for label in field.get_valid_labels():
+            label_value = group_values.get(label)
+            if label_value in (None, "") or isinstance(label_value, bool):
+                continue
+            entries.append(
+                (model_label, field.name, object_id, group, label, str(label_value))
+            )
+    return entries
+
+
+def index_contacts(model, objs, using=None):
+    """
+    Replace the search entries for the given model instances. Instances without
+    a primary key are skipped.
+    """
+    fields = get_search_fields(model)
+    objs = [obj for obj in objs if obj.pk is not None]
+    if not fields or not objs:
+        return
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    backend = get_backend(connection)
+    model_label = model._meta.label_lower
+    object_ids = [str(obj.pk) for obj in objs]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for field in fields:
+            backend.delete(cursor, model_label, field.name, object_ids)
+            entries = []
+            for obj, object_id in zip(objs, object_ids):
+                entries.extend(search_entries(field, obj, object_id))
+            backend.insert(cursor, entries)
+
+
+def remove_contacts(model, pks, using=None):
+    fields = get_search_fields(model)
+    if not fields or not pks:
+        return
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    backend = get_backend(connection)
+    model_label = model._meta.label_lower
+    object_ids = [str(pk) for pk in pks]
+    with connection.cursor() as cursor:
+        for field in fields:
+            backend.delete(cursor, model_label, field.name, object_ids)
+
+
+def index_contacts_for_update(queryset, values):
+    """
+    Replace the search entries for every row in a queryset that is about to be
+    updated with the given {field name: value}, without loading the rows. This
+    must be called before the update, as the queryset may not match afterwards.
+    """
+    model = queryset.model
+    fields = [field for field in get_search_fields(model) if field.name in values]
+    if not fields:
+        return
+    using = queryset.db
+    connection = connections[using]
+    backend = get_backend(connection)
+    model_label = model._meta.label_lower
+    pk_sql, pk_params = (
+        queryset.order_by().values("pk").query.get_compiler(using).as_sql()
+    )
+    ids_sql = "SELECT CAST(pks.{} AS text) AS object_id FROM ({}) pks".format(
+        connection.ops.quote_name(model._meta.pk.column), pk_sql
+    )
+    # Every row will hold the same value, so will have the same entries
+    instance = model(**{field.attname: values[field.name] for field in fields})
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for field in fields:
+            backend.delete_for_query(
+                cursor, model_label, field.name, ids_sql, pk_params
+            )
+            for entry in search_entries(field, instance, None):
+                backend.insert_for_query(cursor, entry, ids_sql, pk_params)
+
+
+def search_sql(model, query, field_names=None, using=None):
+    """
+    Return SQL for filtering a model's table to rows where the start of every
+    word in the query is found in one of their entries, SQL for each row's rank, and the
+    parameters for both. Returns None if the query can't match anything.
+    """
+    # Each word is matched separately, so there's no need to repeat any
+    terms = list(dict.fromkeys(re.findall(r"\w+", query.casefold())))
+    if field_names is None:
+        field_names = [field.name for field in get_search_fields(model)]
+    if not terms or not field_names:
+        return None
+    using = using or router.db_for_read(model)
+    connection = connections[using]
+    backend = get_backend(connection)
+    pk = model._meta.pk
+    pk_column = "{}.{}".format(
+        connection.ops.quote_name(model._meta.db_table),
+        connection.ops.quote_name(pk.column),
+    )
+    match_sql = backend.match_sql(len(terms), len(field_names))
+    where = "{pk} IN (SELECT CAST(m.object_id AS {pk_type}) FROM ({match}) m)".format(
+        pk=pk_column, pk_type=pk.rel_db_type(connection), match=match_sql
+    )
+    rank = (
+        "SELECT m.score FROM ({match}) m WHERE m.object_id = CAST({pk} AS text)".format(
+            pk=pk_column, match=match_sql
+        )
+    )
+    params = (
+        [backend.format_query(term) for term in terms]
+        + [model._meta.label_lower]
+        + list(field_names)
+    )
+    return where, rank, params
+
+
+def index_on_save(sender, instance, raw=False, using=None, **kwargs):
+    if not raw:
+        index_contacts(sender, [instance], using=using)
+
+
+def remove_on_delete(sender, instance, using=None, **kwargs):
+    remove_contacts(sender, [instance.pk], using=using)
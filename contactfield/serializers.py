@@ -0,0 +1,179 @@
+"""
+Helpers for returning contact data as JSON without decoding and re-encoding
+values that are already stored in the field's normalised form.
+
+Fetch the stored JSON with `ContactQuerySet.with_raw_contacts()`, wrap each
+value with `raw_contact()` and render the result with `ContactJsonResponse`,
+`StreamingContactJsonResponse` or (for Django REST Framework) the classes in
+`contactfield.rest_framework`.
+"""
+
+from collections.abc import Mapping
+import json
+import re
+import uuid
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse
+from django.http import StreamingHttpResponse
+
+RAW_SUFFIX = "_json"
+
+
+class RawJSON(Mapping):
+    """
+    A JSON object string that is written verbatim by RawJSONMixin encoders.
+    It is also a read only mapping of the decoded object, so that encoders
+    which accept mappings (such as Django REST Framework's) still work.
+    """
+
+    def __init__(self, json):
+        self.json = json
+        self._value = None
+
+    @property
+    def value(self):
+        if self._value is None:
+            self._value = json.loads(self.json)
+        return self._value
+
+    def __getitem__(self, key):
+        return self.value[key]
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __eq__(self, other):
+        return isinstance(other, RawJSON) and other.json == self.json
+
+    def __repr__(self):
+        return "RawJSON({!r})".format(self.json)
+
+
+class RawJSONMixin(object):
+    """
+    Allows a JSON encoder to write RawJSON values verbatim. Each one is
+    encoded as a unique placeholder string, which is then replaced in the
+    output.
+    """
+
+    def iterencode(self, o, _one_shot=False):
+        self._raw_values = []
+        self._raw_marker = "__contactfield_raw_{}__".format(uuid.uuid4().hex)
+        placeholder = re.compile('"{}([0-9]+)"'.format(self._raw_marker))
+        for chunk in super(RawJSONMixin, self).iterencode(o, _one_shot=_one_shot):
+            if self._raw_values:
+                chunk = placeholder.sub(
+                    lambda match: self._raw_values[int(match.group(1))], chunk
+                )
+            yield chunk
+
+    def default(self, o):
+        if isinstance(o, RawJSON):
+            self._raw_values.append(o.json)
+            return "{}{}".format(self._raw_marker, len(self._raw_values) - 1)
+        return super(RawJSONMixin, self).default(o)
+
+
+class ContactJSONEncoder(RawJSONMixin, DjangoJSONEncoder):
+    pass
+
+
+def is_normalised(field, value):
+    """
+    Return whether a decoded value is exactly what `field.as_dict` would
+    return for it
+    """
+    if not isinstance(value, dict):
+        return False
+    valid_groups = field.get_valid_groups()
+    valid_labels = field.get_valid_labels()
+    concise = field.concise_mode()
+    if concise:
+        if not set(value) <= set(valid_groups):
+            return False
+    elif len(value) != len(valid_groups) or set(value) != set(valid_groups):
+        return False
+    valid_labels_set = set(valid_labels)
+    for labels in value.values():
+        if not isinstance(labels, dict):
+            return False
+        if concise:
+            if not labels or not set(labels) <= valid_labels_set:
+                return False
+            if not all(labels.values()):
+                return False
+        else:
+            if len(labels) != len(valid_labels) or set(labels) != valid_labels_set:
+                return False
+            if not all(
+                label_value or label_value == "" for label_value in labels.values()
+            ):
+                return False
+    return True
+
+
+def contact_json(field, raw):
+    """
+    Return the JSON for a stored contact value. Values which are already
+    normalised are returned as is, while stale values are normalised and
+    re-encoded.
+    """
+    value = raw
+    if isinstance(raw, str):
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            value = None
+        else:
+            if is_normalised(field, value):
+                return raw
+    return json.dumps(field.as_dict(value), **getattr(field, "encoder_kwargs", {}))
+
+
+def raw_contact(instance, field_name):
+    """
+    Return a contact field's value from a model instance as RawJSON, using the
+    stored JSON fetched by `ContactQuerySet.with_raw_contacts()` if present
+    """
+    field = instance._meta.get_field(field_name)
+    raw_name = field_name + RAW_SUFFIX
+    if raw_name in instance.__dict__:
+        return RawJSON(contact_json(field, instance.__dict__[raw_name]))
+    return RawJSON(contact_json(field, field.value_from_object(instance)))
+
+
+class ContactJsonResponse(JsonResponse):
+    """
+    A JsonResponse which writes any RawJSON values verbatim
+    """
+
+    def __init__(self, data, encoder=ContactJSONEncoder, **kwargs):
+        super(ContactJsonResponse, self).__init__(data, encoder=encoder, **kwargs)
+
+
+class StreamingContactJsonResponse(StreamingHttpResponse):
+    """
+    Streams an iterable (such as a queryset iterator) as a JSON list, encoding
+    one item at a time
+    """
+
+    def __init__(
+        self, items, encoder=ContactJSONEncoder, json_dumps_params=None, **kwargs
+    ):
+        kwargs.setdefault("content_type", "application/json")
+        json_dumps_params = json_dumps_params or {}
+        super(StreamingContactJsonResponse, self).__init__(
+            self._encode(items, encoder, json_dumps_params), **kwargs
+        )
+
+    def _encode(self, items, encoder, json_dumps_params):
+        yield "["
+        for i, item in enumerate(items):
+            if i:
+                yield ", "
+            yield json.dumps(item, cls=encoder, **json_dumps_params)
+        yield "]"
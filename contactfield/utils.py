@@ -1,3 +1,10 @@
+from collections import OrderedDict
+from collections import namedtuple
+import copy
+import hashlib
+import threading
+
+
 class CastOnAssign(object):
     """
     An object which ensures that `field.to_python()` is called on assignment to the
@@ -11,7 +18,14 @@ class CastOnAssign(object):
     def __get__(self, obj, type=None):
         if obj is None:
             return self
-        return obj.__dict__[self.field.name]
+        if self.field.attname not in obj.__dict__:
+            # Deferred, e.g. by ContactQuerySet.with_raw_contacts()
+            obj.refresh_from_db(fields=[self.field.attname])
+        value = obj.__dict__[self.field.name]
+        if isinstance(value, FrozenAccessDict):
+            # Shared values are only copied once they are actually accessed
+            value = obj.__dict__[self.field.name] = value.thaw()
+        return value
 
     def __set__(self, obj, value):
         obj.__dict__[self.field.name] = self.field.to_python(value)
@@ -22,6 +36,10 @@ class AccessDict(dict):
         super(AccessDict, self).__init__(*args, **kwargs)
         self.__dict__ = self
 
+    def __reduce__(self):
+        # The default pickling would restore __dict__ as a separate copy
+        return (self.__class__, (dict(self),))
+
     @classmethod
     def prepare(cls, di):
         """
@@ -33,3 +51,161 @@ class AccessDict(dict):
             if type(value) == dict:
                 di[key] = cls.prepare(value)
         return di
+
+
+class FrozenAccessDict(AccessDict):
+    """
+    An AccessDict that can't be modified, so that a single instance can be
+    safely shared. Use `thaw` to get a mutable copy.
+    """
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        object.__setattr__(self, "__dict__", self)
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("'%s' object is immutable" % self.__class__.__name__)
+
+    __setitem__ = _immutable
+    __delitem__ = _immutable
+    __setattr__ = _immutable
+    __delattr__ = _immutable
+    __ior__ = _immutable
+    clear = _immutable
+    pop = _immutable
+    popitem = _immutable
+    setdefault = _immutable
+    update = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @classmethod
+    def prepare(cls, di):
+        """
+        Takes a normal dict and returns a FrozenAccessDict
+        with all nested dicts also frozen
+        """
+        return cls(
+            {
+                key: cls.prepare(value) if isinstance(value, dict) else value
+                for key, value in di.items()
+            }
+        )
+
+    def thaw(self):
+        """
+        Return a mutable AccessDict copy of this dictionary
+        """
+        return AccessDict(
+            {
+                key: value.thaw() if isinstance(value, FrozenAccessDict) else value
+                for key, value in self.items()
+            }
+        )
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class LRUCache(object):
+    """
+    A small, bounded least-recently-used cache. Keeps hit and miss counts in
+    the same form as `functools.lru_cache` so that usage can be monitored.
+    Safe to share between threads.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+def copy_contact_dict(di):
+    """
+    Copy a dictionary of groups and labels, so that changes to the copy (at any
+    depth) don't affect the original
+    """
+    return {
+        group: {
+            label: (
+                value
+                if value is None or isinstance(value, (str, int, float))
+                else copy.deepcopy(value)
+            )
+            for label, value in labels.items()
+        }
+        for group, labels in di.items()
+    }
+
+
+def normalise_contact_value(value):
+    """
+    Fold the case and whitespace of a contact value so that trivially different
+    entries compare equal
+    """
+    if value is None:
+        return ""
+    return " ".join(str(value).split()).casefold()
+
+
+def contact_fingerprint(value, groups, labels):
+    """
+    Return a hash of the normalised values for the given groups and labels, or
+    None if none of them have been set
+    """
+    if not isinstance(value, dict):
+        return None
+    parts = []
+    empty = True
+    for group in groups:
+        group_values = value.get(group) or {}
+        for label in labels:
+            normalised = normalise_contact_value(group_values.get(label))
+            if normalised:
+                empty = False
+            parts.append(normalised)
+    if empty:
+        return None
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
@@ -4,7 +4,13 @@ setup(
     name="django-contactfield",
     version="2.1.0",
     author="Colin Barnwell",
-    packages=["contactfield", "contactfield.templatetags"],
+    packages=[
+        "contactfield",
+        "contactfield.management",
+        "contactfield.management.commands",
+        "contactfield.migrations",
+        "contactfield.templatetags",
+    ],
     description="Customisable contact field for Django",
     long_description=open("README.md").read(),
     install_requires=["django<3", "django-jsonfield"],
@@ -12,6 +18,7 @@ setup(
         "testing": [
             "pytest",
             "pytest-django",
+            "djangorestframework",
             "black",
             "isort",
             "pre-commit",
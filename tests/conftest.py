@@ -1,5 +1,12 @@
+import django
 from django.conf import settings
 
 
 def pytest_configure():
-    settings.configure()
+    settings.configure(
+        DATABASES={
+            "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}
+        },
+        INSTALLED_APPS=["contactfield", "tests"],
+    )
+    django.setup()
@@ -0,0 +1,49 @@
+from django.db import models
+
+from contactfield.fields import ContactField
+from contactfield.querysets import ContactQuerySet
+
+
+class ContactModel(models.Model):
+    contact_field = ContactField(
+        valid_groups=["group_1", "group_2"],
+        valid_labels=["label_1", "label_2"],
+        default={"group_1": {"label_1": "default"}},
+    )
+
+
+class FingerprintModel(models.Model):
+    contact_field = ContactField(
+        valid_groups=["group_1", "group_2"],
+        valid_labels=["label_1", "label_2"],
+        fingerprints={
+            "group_1": {"groups": ["group_1"]},
+            "label_1": {"labels": ["label_1"]},
+        },
+    )
+
+    objects = ContactQuerySet.as_manager()
+
+
+class SearchModel(models.Model):
+    contact_field = ContactField(
+        valid_groups=["group_1", "group_2"],
+        valid_labels=["label_1", "label_2"],
+        search_index=True,
+    )
+
+    objects = ContactQuerySet.as_manager()
+
+
+class UpperContactField(ContactField):
+    def _initial_dict(self, initial=None):
+        return {
+            group: {label: value.upper() for label, value in labels.items()}
+            for group, labels in super()._initial_dict(initial).items()
+        }
+
+
+class UpperContactModel(models.Model):
+    contact_field = UpperContactField(
+        valid_groups=["group_1", "group_2"], valid_labels=["label_1", "label_2"]
+    )
@@ -1,10 +1,42 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+import json
+import threading
 from unittest import TestCase
+from unittest import skipUnless
 
 from django import forms
-
-from contactfield.fields import BaseContactField, ContactFormField, ContactField
+from django.core.management import call_command
+from django.db.models import Value
+from django.test import TestCase as DatabaseTestCase
+from django.test import TransactionTestCase
+
+from contactfield.aio import aiter_contacts
+from contactfield.aio import anormalize_many
+from contactfield.fields import BaseContactField
+from contactfield.fields import ContactField
+from contactfield.fields import ContactFormField
 from contactfield.forms import ContactFieldFormMixin
+from contactfield.serializers import ContactJsonResponse
+from contactfield.serializers import RawJSON
+from contactfield.serializers import StreamingContactJsonResponse
+from contactfield.serializers import contact_json
+from contactfield.serializers import raw_contact
 from contactfield.templatetags.contactfield_tags import contact_cards
+from contactfield.utils import FrozenAccessDict
+from contactfield.utils import LRUCache
+
+try:
+    import rest_framework
+except ImportError:
+    rest_framework = None
+
+from .models import ContactModel
+from .models import FingerprintModel
+from .models import SearchModel
+from .models import UpperContactField
+from .models import UpperContactModel
 
 
 class FormFieldTest(TestCase):
@@ -66,6 +98,79 @@ class FormFieldTest(TestCase):
             {"test_group": {"test_label": "Success", "no_such_label": "Failure"}}
         ) == {"test_group": {"test_label": "Success"}}
 
+    def test_cache(self):
+        field = self.field_class(
+            valid_groups=["test_group"], valid_labels=["test_label"], cache_size=2
+        )
+        # Ignore any lookups made while normalising the default or initial value
+        field.cache_clear()
+        assert field.cache_info() == (0, 0, 2, 0)
+        raw = '{"test_group": {"test_label": "Success"}}'
+        assert field.as_dict(raw) == {"test_group": {"test_label": "Success"}}
+        assert field.as_dict(raw) == {"test_group": {"test_label": "Success"}}
+        assert field.cache_info() == (1, 1, 2, 1)
+
+        # Results can't be used to corrupt the cache
+        field.as_dict(raw)["test_group"]["test_label"] = "Failure"
+        assert field.as_dict(raw) == {"test_group": {"test_label": "Success"}}
+
+        # Empty values share an entry, dictionaries bypass the cache
+        assert field.as_dict(None) == field.as_dict("") == field.as_dict({})
+        field.as_dict({"test_group": {"test_label": "Success"}})
+        assert field.cache_info() == (5, 2, 2, 2)
+
+        # Least recently used entries are evicted
+        field.as_dict("[]")
+        assert field.cache_info().currsize == 2
+        field.as_dict(raw)
+        assert field.cache_info().misses == 4
+
+        # Nested values can't be used to corrupt the cache either
+        nested = '{"test_group": {"test_label": [1, 2]}}'
+        field.as_dict(nested)["test_group"]["test_label"].append(3)
+        assert field.as_dict(nested) == {"test_group": {"test_label": [1, 2]}}
+
+        # The schema is part of the key
+        concise_field = self.field_class(
+            valid_groups=["test_group"], valid_labels=["test_label"], concise=True
+        )
+        assert concise_field.schema_key() != field.schema_key()
+        assert concise_field.as_dict(None) == {}
+        # Including changes made after the field is created
+        assert field.as_dict(None) == {"test_group": {"test_label": ""}}
+        field._concise = True
+        assert field.as_dict(None) == {}
+        field._concise = False
+
+        field.cache_clear()
+        assert field.cache_info() == (0, 0, 2, 0)
+        assert self.field_class().cache_info() is None
+
+
+class LRUCacheTest(TestCase):
+
+    def test_threads(self):
+        cache = LRUCache(maxsize=4)
+        errors = []
+
+        def hammer(offset):
+            try:
+                for i in range(2000):
+                    key = (i + offset) % 8
+                    if cache.get(key) is None:
+                        cache.set(key, key)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=hammer, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert len(cache) <= 4
+        assert cache.info().hits + cache.info().misses == 16000
+
 
 class ModelFieldTest(FormFieldTest):
     field_class = ContactField
@@ -88,6 +193,405 @@ class ModelFieldTest(FormFieldTest):
         assert field.group_display_names == form_field.group_display_names
         assert field.label_display_names == form_field.label_display_names
         assert field._concise == form_field._concise
+        assert form_field.cache_info() is None
+        assert field.formfield(cache_size=8).cache_info().maxsize == 8
+
+    def test_shared_default(self):
+        field = ContactField(valid_groups=["test"], valid_labels=["test"])
+        other_field = ContactField(valid_groups=["test"], valid_labels=["test"])
+        assert isinstance(field.default, FrozenAccessDict)
+        assert field.get_default() is field.get_default()
+        assert field.get_default() is other_field.get_default()
+        assert field.formfield().initial is field.default
+
+        # Fields which normalise values differently don't share them
+        value = {"test": {"test": "shared"}}
+        assert ContactField(
+            valid_groups=["test"], valid_labels=["test"], default=value
+        ).default == {"test": {"test": "shared"}}
+        assert UpperContactField(
+            valid_groups=["test"], valid_labels=["test"], default=value
+        ).default == {"test": {"test": "SHARED"}}
+
+        with self.assertRaises(TypeError):
+            field.get_default().test.test = "Failure"
+
+
+class ModelTest(DatabaseTestCase):
+
+    def test_shared_default(self):
+        field = ContactModel._meta.get_field("contact_field")
+        instance = ContactModel()
+        other_instance = ContactModel()
+        assert instance.__dict__["contact_field"] is field.default
+        assert other_instance.__dict__["contact_field"] is field.default
+
+        # Copied on access
+        instance.contact_field.group_1.label_2 = "Success"
+        assert type(instance.__dict__["contact_field"]) is not FrozenAccessDict
+        assert field.default.group_1.label_2 == ""
+        assert other_instance.__dict__["contact_field"] is field.default
+
+        ContactModel.objects.bulk_create([instance, other_instance])
+        assert [
+            contact_field.group_1
+            for contact_field in ContactModel.objects.values_list(
+                "contact_field", flat=True
+            ).order_by("pk")
+        ] == [
+            {"label_1": "default", "label_2": "Success"},
+            {"label_1": "default", "label_2": ""},
+        ]
+
+    def test_fingerprints(self):
+        instance = FingerprintModel.objects.create(
+            contact_field={"group_1": {"label_1": " Some  Value", "label_2": "x"}}
+        )
+        assert instance.contact_field_group_1_fingerprint is not None
+        assert instance.contact_field_label_1_fingerprint is not None
+
+        FingerprintModel.objects.bulk_create(
+            [
+                FingerprintModel(
+                    contact_field={"group_1": {"label_1": "some value", "label_2": "X"}}
+                ),
+                FingerprintModel(contact_field={"group_2": {"label_1": "SOME VALUE"}}),
+                FingerprintModel(),
+            ]
+        )
+        assert list(
+            FingerprintModel.objects.duplicate_contacts(
+                "contact_field_group_1_fingerprint"
+            )
+        ) == [
+            {
+                "contact_field_group_1_fingerprint": (
+                    instance.contact_field_group_1_fingerprint
+                ),
+                "count": 2,
+            }
+        ]
+        assert [
+            duplicate["count"]
+            for duplicate in FingerprintModel.objects.duplicate_contacts(
+                "contact_field_label_1_fingerprint"
+            )
+        ] == [2]
+
+        # Bulk updates keep fingerprints in sync
+        instance.contact_field.group_1.label_2 = "y"
+        FingerprintModel.objects.bulk_update([instance], ["contact_field"])
+        assert not FingerprintModel.objects.duplicate_contacts(
+            "contact_field_group_1_fingerprint"
+        ).exists()
+
+        FingerprintModel.objects.update(contact_field={"group_1": {"label_1": "same"}})
+        assert [
+            duplicate["count"]
+            for duplicate in FingerprintModel.objects.duplicate_contacts(
+                "contact_field_group_1_fingerprint"
+            )
+        ] == [4]
+
+    def test_fingerprints_update_fields(self):
+        obj = FingerprintModel.objects.create(
+            contact_field={"group_1": {"label_1": "John"}}
+        )
+        obj.contact_field.group_1.label_1 = "Jane"
+        obj.save(update_fields=["contact_field"])
+        expected = obj.contact_field_group_1_fingerprint
+        assert (
+            expected
+            == FingerprintModel.objects.create(
+                contact_field={"group_1": {"label_1": "Jane"}}
+            ).contact_field_group_1_fingerprint
+        )
+        obj.refresh_from_db()
+        assert obj.contact_field_group_1_fingerprint == expected
+
+    def test_fingerprints_update(self):
+        FingerprintModel.objects.bulk_create(
+            [
+                FingerprintModel(contact_field={"group_1": {"label_1": "a"}}),
+                FingerprintModel(contact_field={"group_1": {"label_1": "b"}}),
+            ]
+        )
+        FingerprintModel.objects.update(
+            contact_field='{"group_1": {"label_1": "same"}}'
+        )
+        assert [
+            duplicate["count"]
+            for duplicate in FingerprintModel.objects.duplicate_contacts(
+                "contact_field_group_1_fingerprint"
+            )
+        ] == [2]
+        assert FingerprintModel.objects.first().contact_field.group_1.label_1 == (
+            "same"
+        )
+
+        # Fingerprints for expressions are calculated after the update
+        FingerprintModel.objects.update(
+            contact_field=Value('{"group_1": {"label_1": "other"}}')
+        )
+        expected = FingerprintModel.objects.create(
+            contact_field={"group_1": {"label_1": "other"}}
+        ).contact_field_group_1_fingerprint
+        assert [
+            duplicate["count"]
+            for duplicate in FingerprintModel.objects.duplicate_contacts(
+                "contact_field_group_1_fingerprint"
+            )
+        ] == [3]
+        assert (
+            FingerprintModel.objects.first().contact_field_group_1_fingerprint
+            == expected
+        )
+
+    def test_find_duplicate_contacts_command(self):
+        FingerprintModel.objects.bulk_create(
+            [
+                FingerprintModel(contact_field={"group_1": {"label_1": "a"}}),
+                FingerprintModel(contact_field={"group_1": {"label_1": "A "}}),
+            ]
+        )
+        FingerprintModel.objects.update(contact_field_group_1_fingerprint=None)
+
+        out = StringIO()
+        call_command(
+            "find_duplicate_contacts",
+            "tests.FingerprintModel",
+            "contact_field_group_1_fingerprint",
+            "--refresh",
+            stdout=out,
+        )
+        assert "Refreshed fingerprints for 2 rows" in out.getvalue()
+        assert "(2 rows)" in out.getvalue()
+        assert "Found 1 duplicate groups" in out.getvalue()
+
+    def test_search_contacts(self):
+        smith = SearchModel.objects.create(
+            contact_field={"group_1": {"label_1": "John Smith", "label_2": "London"}}
+        )
+        smithson = SearchModel.objects.create(
+            contact_field={"group_2": {"label_1": "Jane Smithson"}}
+        )
+        SearchModel.objects.create(contact_field={"group_1": {"label_1": "Someone"}})
+
+        assert list(SearchModel.objects.search_contacts("smith")) == [
+            smith,
+            smithson,
+        ]
+        assert list(SearchModel.objects.search_contacts("Jo SMI")) == [smith]
+        assert list(SearchModel.objects.search_contacts("smith")[:1]) == [smith]
+        # Words can match different groups and labels, but all have to match
+        assert list(SearchModel.objects.search_contacts("Smith London")) == [smith]
+        assert list(SearchModel.objects.search_contacts("john london john")) == [smith]
+        assert not SearchModel.objects.search_contacts("Jane London").exists()
+        assert not SearchModel.objects.search_contacts("").exists()
+        assert SearchModel.objects.search_contacts("jane")[0].search_rank > 0
+
+        # Saving and deleting keep the index in sync
+        smith.contact_field.group_1.label_2 = "Paris"
+        smith.save()
+        assert list(SearchModel.objects.search_contacts("paris")) == [smith]
+        assert not SearchModel.objects.search_contacts("london").exists()
+        smith.delete()
+        assert not SearchModel.objects.search_contacts("paris").exists()
+
+        # As do bulk operations
+        smithson.contact_field.group_2.label_2 = "Leeds"
+        SearchModel.objects.bulk_update([smithson], ["contact_field"])
+        assert list(SearchModel.objects.search_contacts("leeds")) == [smithson]
+        SearchModel.objects.filter(pk=smithson.pk).update(
+            contact_field={"group_1": {"label_1": "York"}}
+        )
+        assert list(SearchModel.objects.search_contacts("york")) == [smithson]
+        assert not SearchModel.objects.search_contacts("leeds").exists()
+
+        # SQLite doesn't return primary keys from bulk inserts
+        with self.assertWarns(RuntimeWarning):
+            SearchModel.objects.bulk_create(
+                [SearchModel(contact_field={"group_1": {"label_1": "Bulk"}})]
+            )
+        assert SearchModel.objects.reindex_contacts() == 3
+        assert SearchModel.objects.search_contacts("bulk").count() == 1
+
+    def test_search_contacts_update(self):
+        for name in ("Ann", "Bob", "Cat"):
+            SearchModel.objects.create(contact_field={"group_1": {"label_1": name}})
+        other = SearchModel.objects.create(
+            contact_field={"group_1": {"label_1": "Dan"}}
+        )
+        rows = SearchModel.objects.exclude(pk=other.pk)
+
+        assert rows.update(contact_field={"group_2": {"label_2": "Updated"}}) == 3
+        assert set(SearchModel.objects.search_contacts("updated")) == set(rows)
+        assert not SearchModel.objects.search_contacts("ann").exists()
+        assert list(SearchModel.objects.search_contacts("dan")) == [other]
+
+        # The new values of expressions are indexed after the update
+        assert (
+            rows.update(contact_field=Value('{"group_1": {"label_2": "Expression"}}'))
+            == 3
+        )
+        assert set(SearchModel.objects.search_contacts("expression")) == set(rows)
+        assert not SearchModel.objects.search_contacts("updated").exists()
+        assert list(SearchModel.objects.search_contacts("dan")) == [other]
+
+    def test_raw_contacts(self):
+        field = SearchModel._meta.get_field("contact_field")
+        normalised = SearchModel.objects.create(
+            contact_field=field.as_dict({"group_1": {"label_1": "Normalised"}})
+        )
+        stale = SearchModel.objects.create()
+        SearchModel.objects.filter(pk=stale.pk).update(
+            contact_field={"group_1": {"label_1": "Stale", "unknown": "x"}}
+        )
+
+        instances = list(SearchModel.objects.with_raw_contacts().order_by("pk"))
+        assert "contact_field" not in instances[0].__dict__
+        assert raw_contact(instances[0], "contact_field") == RawJSON(
+            instances[0].contact_field_json
+        )
+        assert json.loads(raw_contact(instances[1], "contact_field").json) == (
+            field.as_dict({"group_1": {"label_1": "Stale"}})
+        )
+        assert contact_json(field, "not json") == json.dumps(field.as_dict(None))
+
+        # Without the stored JSON the current value is used
+        assert json.loads(raw_contact(normalised, "contact_field").json) == (
+            normalised.contact_field
+        )
+
+        response = ContactJsonResponse(
+            [
+                {"pk": instance.pk, "contact": raw_contact(instance, "contact_field")}
+                for instance in instances
+            ],
+            safe=False,
+        )
+        assert instances[0].contact_field_json in response.content.decode()
+        assert json.loads(response.content.decode())[1]["contact"]["group_1"] == {
+            "label_1": "Stale",
+            "label_2": "",
+        }
+
+        response = StreamingContactJsonResponse(
+            {"contact": raw_contact(instance, "contact_field")}
+            for instance in instances
+        )
+        assert [
+            item["contact"]["group_1"]["label_1"]
+            for item in json.loads(b"".join(response.streaming_content).decode())
+        ] == ["Normalised", "Stale"]
+
+    def test_raw_contacts_save(self):
+        obj = FingerprintModel.objects.create(
+            contact_field={"group_1": {"label_1": "John"}}
+        )
+        fingerprint = obj.contact_field_group_1_fingerprint
+
+        # Deferred values are loaded when read or saved
+        instance = FingerprintModel.objects.with_raw_contacts().get()
+        assert instance.contact_field.group_1.label_1 == "John"
+        instance = FingerprintModel.objects.with_raw_contacts().get()
+        instance.save()
+        obj.refresh_from_db()
+        assert obj.contact_field.group_1.label_1 == "John"
+        assert obj.contact_field_group_1_fingerprint == fingerprint
+
+        searchable = SearchModel.objects.create(
+            contact_field={"group_1": {"label_1": "Jane"}}
+        )
+        SearchModel.objects.with_raw_contacts().get().save()
+        assert list(SearchModel.objects.search_contacts("jane")) == [searchable]
+
+
+@skipUnless(rest_framework, "Django REST Framework is not installed")
+class RestFrameworkTest(DatabaseTestCase):
+    def test_raw_contact_serializer_field(self):
+        from rest_framework import serializers
+        from rest_framework.renderers import JSONRenderer
+
+        from contactfield.rest_framework import ContactJSONRenderer
+        from contactfield.rest_framework import RawContactSerializerField
+
+        class SearchSerializer(serializers.ModelSerializer):
+            contact_field = RawContactSerializerField()
+
+            class Meta:
+                model = SearchModel
+                fields = ["id", "contact_field"]
+
+        field = SearchModel._meta.get_field("contact_field")
+        SearchModel.objects.create(
+            contact_field=field.as_dict({"group_1": {"label_1": "Normalised"}})
+        )
+        instance = SearchModel.objects.with_raw_contacts().get()
+
+        data = SearchSerializer([instance], many=True).data
+        content = ContactJSONRenderer().render(data).decode()
+        assert instance.contact_field_json in content
+        assert json.loads(content)[0]["contact_field"]["group_1"]["label_1"] == (
+            "Normalised"
+        )
+        # The stored JSON is used without loading the deferred field
+        assert "contact_field" not in instance.__dict__
+
+        # Other renderers encode the decoded value
+        assert json.loads(JSONRenderer().render(data).decode()) == json.loads(content)
+
+
+class AsyncTest(TransactionTestCase):
+
+    def test_anormalize_many(self):
+        field = ContactField(valid_groups=["test"], valid_labels=["test"])
+        values = ['{"test": {"test": "%s"}}' % i for i in range(5)] + [None, {}]
+        expected = [field.as_dict(value) for value in values]
+
+        results = asyncio.run(anormalize_many(field, values, batch_size=2))
+        assert results == expected
+        assert results[0].test.test == "0"
+
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            results = asyncio.run(
+                anormalize_many(field, values, executor=executor, batch_size=2)
+            )
+        assert results == expected
+        # Attribute and item access still refer to the same values
+        results[0].test.test = "changed"
+        assert results[0]["test"]["test"] == "changed"
+        results[1]["test"]["test"] = "changed"
+        assert results[1].test.test == "changed"
+
+    def test_anormalize_many_model_field(self):
+        # Model fields are normalised by the field itself in other processes
+        field = UpperContactModel._meta.get_field("contact_field")
+        values = ['{"group_1": {"label_1": "john"}}', None]
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results = asyncio.run(anormalize_many(field, values, executor=executor))
+        assert results == [field.as_dict(value) for value in values]
+        assert results[0].group_1.label_1 == "JOHN"
+
+    def test_aiter_contacts(self):
+        field = SearchModel._meta.get_field("contact_field")
+        instances = [
+            SearchModel.objects.create(contact_field={"group_1": {"label_1": str(i)}})
+            for i in range(5)
+        ]
+
+        async def collect():
+            return [
+                (pk, value)
+                async for pk, value in aiter_contacts(
+                    SearchModel.objects.all(), "contact_field", chunk_size=2
+                )
+            ]
+
+        assert asyncio.run(collect()) == [
+            (instance.pk, field.as_dict(instance.contact_field))
+            for instance in instances
+        ]
 
 
 class FormMixinTest(TestCase):
@@ -145,6 +649,33 @@ class FormMixinTest(TestCase):
         self.assertTrue(form.is_valid())
         assert form.cleaned_data["contact_field"] == {"group_1": {"label_1": "1"}}
 
+    def test_form_field_merged(self):
+        initial = {"contact_field": {"group_3": {"label_3": "kept"}}}
+        expected = {
+            "group_1": {"label_1": "1", "label_2": "2"},
+            "group_3": {"label_3": "kept"},
+        }
+
+        # Fewer submitted values than pseudo fields
+        form = self.form_class(
+            initial=initial,
+            data={
+                "contact_field__group_1__label_1": "1",
+                "contact_field__group_1__label_2": "2",
+            },
+        )
+        self.assertTrue(form.is_valid())
+        assert form.cleaned_data["contact_field"] == expected
+
+        # More submitted values than pseudo fields
+        data = {"other_{}".format(i): "x" for i in range(10)}
+        data["contact_field__group_1__label_1"] = "1"
+        data["contact_field__group_1__label_2"] = "2"
+        data["contact_field__group_3__label_3"] = "ignored"
+        form = self.form_class(initial=initial, data=data)
+        self.assertTrue(form.is_valid())
+        assert form.cleaned_data["contact_field"] == expected
+
 
 class TemplateTagsTest(TestCase):
 